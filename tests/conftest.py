@@ -0,0 +1,21 @@
+"""测试共用: 用 importlib 加载脚本 (文件名带 "-"，不能直接 import)。"""
+import importlib.util
+import os
+
+import pytest
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "youzhiyouxing-All3.0.py")
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location("youzhiyouxing_all", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="module")
+def yz():
+    module = load_script()
+    yield module
+    module.TRANSPORT.close()
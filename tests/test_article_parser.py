@@ -0,0 +1,120 @@
+"""
+【v8.5】流式文章解析 (iter_article_markdown) 的离线测试:
+本机假服务器返回各种形状的文章页，检查标题选择和缺少正文容器时的处理。
+
+运行: python -m pytest -q tests
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+PAGES = {
+    # 有 h2.tw-text-22 标题，但整页没有正文容器
+    "/no-root": '<html><body><h2 class="tw-text-22">标题</h2><p>正文</p></body></html>',
+    # h2.tw-text-22 在正文容器之后出现，仍然优先于前面的普通 h2
+    "/late-title": (
+        '<html><body><h2>first</h2>'
+        '<div id="zx-material-marker-root"><p>正文</p><h2>想法</h2><p>不应出现</p></div>'
+        '<h2 class="tw-text-22">Real</h2></body></html>'
+    ),
+    # h2.tw-text-22 在正文容器内部
+    "/title-in-root": (
+        '<html><body><h2>first</h2>'
+        '<div id="zx-material-marker-root"><p>正文</p><h2 class="tw-text-22">Real</h2><p>后文</p></div>'
+        '</body></html>'
+    ),
+    # 整页只有正文里的普通 h2
+    "/h2-in-root": (
+        '<html><body><div id="zx-material-marker-root"><p>前言</p><h2>小节</h2><p>正文</p></div>'
+        '</body></html>'
+    ),
+    # 常见情况: 标题在正文容器之前
+    "/normal": (
+        '<html><body><h2 class="tw-text-22">标题</h2>'
+        '<div id="zx-material-marker-root"><body><p>开头 <b>加粗</b></p>'
+        '<p><img data-src="/img/a.png" alt="图A"></p><h2>想法</h2><p>不应出现</p></body></div>'
+        '</body></html>'
+    ),
+    "/no-title": '<html><body><p>正文</p></body></html>',
+}
+
+
+class FakeSite(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = PAGES[self.path].encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def site(yz, tmp_path, monkeypatch):
+    monkeypatch.setattr(yz, "MANIFEST_PATH", str(tmp_path / "manifest.sqlite3"))
+    monkeypatch.setattr(yz, "REQUEST_INTERVAL", 0)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSite)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def fake_fetcher(img_url, save_dir):
+    return "local.png"
+
+
+def scrape(yz, url, tmp_path):
+    return yz.scrape_article_page(url, str(tmp_path), fake_fetcher)
+
+
+def test_missing_container_keeps_title(yz, site, tmp_path):
+    title, markdown = scrape(yz, f"{site}/no-root", tmp_path)
+    assert title == "标题"
+    assert markdown == "# 标题\n\n[爬取失败：未找到正文容器]"
+
+
+def test_missing_container_writes_nonempty_article(yz, site, tmp_path):
+    article = yz.PlanEntry("", "章节", "1-标题.md", "标题", f"{site}/no-root")
+    assert yz.process_article(article, str(tmp_path), str(tmp_path / "images"), fake_fetcher)
+    yz.WRITER.commit()
+    with open(article.local_path(str(tmp_path)), encoding="utf-8") as f:
+        assert f.read() == "# 标题\n\n[爬取失败：未找到正文容器]"
+
+
+def test_title_after_container_wins(yz, site, tmp_path):
+    title, markdown = scrape(yz, f"{site}/late-title", tmp_path)
+    assert title == "Real"
+    assert markdown == "# Real\n\n正文\n"
+
+
+def test_title_inside_container_wins(yz, site, tmp_path):
+    title, markdown = scrape(yz, f"{site}/title-in-root", tmp_path)
+    assert title == "Real"
+    assert markdown == "# Real\n\n正文\n\n\n## Real\n\n后文\n"
+
+
+def test_first_h2_in_container_as_fallback(yz, site, tmp_path):
+    title, markdown = scrape(yz, f"{site}/h2-in-root", tmp_path)
+    assert title == "小节"
+    assert markdown == "# 小节\n\n前言\n\n\n## 小节\n\n正文\n"
+
+
+def test_normal_page(yz, site, tmp_path):
+    fetched = []
+    title, markdown = yz.scrape_article_page(
+        f"{site}/normal", str(tmp_path), lambda img_url, save_dir: fetched.append(img_url) or "local.png"
+    )
+    local_filename = yz.image_local_filename("/img/a.png")[1]
+    assert title == "标题"
+    assert markdown == f"# 标题\n\n开头 **加粗**\n\n![图A]({local_filename})\n"
+    assert fetched == ["/img/a.png"]
+
+
+def test_no_title(yz, site, tmp_path):
+    assert scrape(yz, f"{site}/no-title", tmp_path) == (None, None)
@@ -0,0 +1,143 @@
+"""
+【v8.6】传输层 (Transport) 的离线测试: 在本机线程里起一个假服务器，
+检查连接复用、发出的请求头、压缩协商和字节统计。
+
+运行: python -m pytest -q tests
+"""
+import gzip
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+BODY = ("<html><body>" + "有知有行 " * 2000 + "</body></html>").encode("utf-8")
+
+
+class FakeSite(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 保持连接，才能测试复用
+    requests_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        FakeSite.requests_seen.append((self.path, dict(self.headers)))
+        body = BODY
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def site():
+    FakeSite.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSite)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def transport(yz):
+    transport = yz.Transport(yz.HEADERS, dns_ttl=0)
+    yield transport
+    transport.close()
+
+
+def test_connection_is_reused(transport, site):
+    for i in range(3):
+        response = transport.session.get(f"{site}/page/{i}", timeout=5)
+        assert response.content == BODY
+
+    assert transport.stats["requests"] == 3
+    assert transport.stats["new_connections"] == 1
+    assert "复用连接 2 次" in transport.summary()
+
+
+def test_headers_sent(yz, transport, site):
+    transport.session.get(f"{site}/page", timeout=5).content
+
+    (path, headers), = FakeSite.requests_seen
+    assert path == "/page"
+    assert headers["User-Agent"] == yz.HEADERS["User-Agent"]
+    assert "gzip" in headers["Accept-Encoding"]
+    assert "deflate" in headers["Accept-Encoding"]
+    assert headers["Connection"] == "keep-alive"
+
+
+def test_bytes_received_counts_decoded_body(transport, site):
+    response = transport.session.get(f"{site}/page", timeout=5)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.content == BODY
+    assert transport.stats["bytes_received"] == len(BODY)
+
+
+def test_streamed_bytes_are_counted(transport, site):
+    with transport.session.get(f"{site}/page", stream=True, timeout=5) as response:
+        received = sum(len(chunk) for chunk in response.iter_content(1024))
+
+    assert received == len(BODY)
+    assert transport.stats["bytes_received"] == len(BODY)
+
+
+def test_per_host_pool_sizes(yz, site):
+    host = site.split("//", 1)[1]
+    transport = yz.Transport(yz.HEADERS, pool_size=10, host_pool_sizes={host: 2}, dns_ttl=0)
+    try:
+        host_adapter = transport.session.get_adapter(f"{site}/page")
+        other_adapter = transport.session.get_adapter("http://example.com/")
+        assert host_adapter is not other_adapter
+        assert host_adapter._pool_maxsize == 2
+        assert other_adapter._pool_maxsize == 10
+    finally:
+        transport.close()
+
+
+def test_dns_cache_only_applies_to_transport_requests(yz, site):
+    transport = yz.Transport(yz.HEADERS, dns_ttl=60)
+    try:
+        assert socket.getaddrinfo == transport.dns_cache.getaddrinfo
+
+        # 传输层之外的调用直接交给系统实现，不计入缓存
+        socket.getaddrinfo("localhost", 80)
+        assert transport.dns_cache.misses == 0
+
+        url = site.replace("127.0.0.1", "localhost")
+        for _ in range(2):
+            transport.session.get(f"{url}/page", timeout=5, headers={"Connection": "close"}).content
+        assert transport.stats["new_connections"] == 2
+        assert transport.dns_cache.misses == 1
+        assert transport.dns_cache.hits == 1
+    finally:
+        transport.close()
+    assert socket.getaddrinfo == yz._SYSTEM_GETADDRINFO
+
+
+def test_http2_adapter(yz, site):
+    pytest.importorskip("httpx")
+    pytest.importorskip("h2")
+    transport = yz.Transport(yz.HEADERS, http2=True, dns_ttl=0)
+    try:
+        assert transport.http2
+        for i in range(3):
+            response = transport.session.get(f"{site}/page/{i}", timeout=5)
+            assert response.content == BODY
+
+        # 明文 http 上 httpx 使用 HTTP/1.1，但同样复用连接
+        assert transport.stats["requests"] == 3
+        assert transport.stats["new_connections"] == 1
+        assert transport.stats["bytes_received"] == 3 * len(BODY)
+        (path, headers) = FakeSite.requests_seen[0]
+        assert headers["User-Agent"] == yz.HEADERS["User-Agent"]
+        assert "gzip" in headers["Accept-Encoding"]
+    finally:
+        transport.close()
@@ -1,11 +1,30 @@
 import os
 import re
+import sys
 import json
 import time
+import socket
+import ssl
+import sqlite3
+import argparse
+import threading
 import requests
 import hashlib
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
+from lxml import etree
 from urllib.parse import urljoin
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection
+from urllib3.util.request import ACCEPT_ENCODING
+
+# 【v8.6】可选依赖: 安装 httpx[http2] 后可以启用 HTTP/2 多路复用
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 # --- 1. 全局配置 (Global Configuration) ---
 
@@ -54,20 +73,331 @@ HEADERS = {
                   '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
 
-# 启动一个共享的 Session，提高网络效率
-SESSION = requests.Session()
-SESSION.headers.update(HEADERS)
+# 【v8.6】连接池: 每个主机各自一个池，站点页面和图片 CDN 不再互相争抢
+# POOL_SIZE 是默认的每主机连接数，HOST_POOL_SIZES 可以为个别主机单独指定
+POOL_SIZE = 10
+HOST_POOL_SIZES = {
+    "youzhiyouxing.cn": 4,
+}
+
+# 【v8.6】DNS 解析结果缓存时长 (秒)，0 表示不缓存
+DNS_CACHE_TTL = 300
+
+# 【v8.0】抓取清单 (SQLite)，同时充当多 worker 共享的工作队列
+# 多台机器共享同一个文件系统时，让它们指向同一个文件即可
+MANIFEST_PATH = os.path.join(SCRIPT_DIR, "crawl_manifest.sqlite3")
+
+# 【v8.0】全局限速：所有 worker 合计，每隔多少秒最多发出一个页面请求
+REQUEST_INTERVAL = 1
+
+# 【v8.0】任务租约时长 (秒)。worker 崩溃后，租约过期的任务会被其他 worker 重新领取
+LEASE_SECONDS = 600
+
+# 【v8.0】单个任务最多尝试次数，超过后标记为 failed
+MAX_ATTEMPTS = 3
+
+# 【v8.1】延迟图片模式下，图片阶段的独立限速 (秒/张，所有 worker 合计)
+IMAGE_REQUEST_INTERVAL = 0.5
+
+# 【v8.3】完整性检查时使用的线程数
+AUDIT_WORKERS = 8
+
+# 【v8.7】本次运行的预算 (None 表示不限)。用完后不再领取新任务，手上的任务做完后干净退出，
+# 剩下的任务留在队列里，下次运行按优先级继续
+MAX_REQUESTS = None
+MAX_SECONDS = None
+RUN_STARTED = time.time()
 
 
 # --- 2. 辅助工具函数 (Helper Functions) ---
 
+# 系统原始的解析函数 (重新配置传输层时，新的 DNS 缓存总是包装它，而不是上一个缓存)
+_SYSTEM_GETADDRINFO = socket.getaddrinfo
+
+class _DNSCache:
+    """
+    【v8.6】DNS 缓存: 替换 socket.getaddrinfo，同一个主机在 TTL 内只解析一次。
+    urllib3 和 httpx 建立连接时都会经过 socket.getaddrinfo。
+    注意: socket.getaddrinfo 是进程级的，导入本脚本时 (configure_transport()) 就会被替换。
+    只有在 scope() 之内 (即经由 Transport 发出的请求) 才使用缓存，
+    其他代码的调用直接转给系统实现；uninstall() 可恢复原样。
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._getaddrinfo = _SYSTEM_GETADDRINFO
+
+    @contextmanager
+    def scope(self):
+        """在当前线程中启用缓存。"""
+        self._local.active = True
+        try:
+            yield
+        finally:
+            self._local.active = False
+
+    def getaddrinfo(self, host, port, *args, **kwargs):
+        if not getattr(self._local, 'active', False):
+            return self._getaddrinfo(host, port, *args, **kwargs)
+        key = (host, port, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                self.hits += 1
+                return cached[1]
+        result = self._getaddrinfo(host, port, *args, **kwargs)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = (now + self.ttl, result)
+        return result
+
+    def install(self):
+        socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        if socket.getaddrinfo == self.getaddrinfo:
+            socket.getaddrinfo = _SYSTEM_GETADDRINFO
+
+def _counting_pool_class(base, transport):
+    """【v8.6】生成一个会统计新建连接数 (成功建立的 TCP 连接) 的 urllib3 连接池类。"""
+    class CountingConnection(base.ConnectionCls):
+        def connect(self):
+            super().connect()
+            transport._count('new_connections')
+
+    class CountingPool(base):
+        ConnectionCls = CountingConnection
+    return CountingPool
+
+class _PooledAdapter(requests.adapters.HTTPAdapter):
+    """
+    【v8.6】HTTP/1.1 适配器: 开启 TCP keep-alive，并统计新建连接数。
+    """
+
+    def __init__(self, transport, **kwargs):
+        self._transport = transport
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault(
+            'socket_options',
+            HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        )
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool_class(HTTPConnectionPool, self._transport),
+            'https': _counting_pool_class(HTTPSConnectionPool, self._transport),
+        }
+
+    def send(self, request, **kwargs):
+        with self._transport.dns_scope():
+            return super().send(request, **kwargs)
+
+class _HTTPXRaw:
+    """【v8.6】让 httpx 的流式响应看起来像 urllib3 的 raw 响应，供 requests.Response 使用。"""
+
+    def __init__(self, response):
+        self._response = response
+
+    def stream(self, amt=1024, decode_content=True):
+        try:
+            yield from self._response.iter_bytes(amt)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        finally:
+            self._response.close()
+
+    def read(self, amt=None, decode_content=True):
+        return b"".join(self.stream(amt or 1024 * 1024))
+
+    def close(self):
+        self._response.close()
+
+    def release_conn(self):
+        self._response.close()
+
+class _HTTP2Adapter(requests.adapters.BaseAdapter):
+    """
+    【v8.6】HTTP/2 适配器 (需要 httpx[http2])。
+    同一主机的所有请求在一条连接上多路复用；对外仍然是 requests.Response，调用方无需改动。
+    httpx 的 verify/cert/代理是按客户端设置的，所以每种 (verify, cert, 代理) 组合各用一个客户端。
+    代理地址由 requests 选出 (已合并环境变量)，httpx 自己不再读取环境变量。
+    """
+
+    def __init__(self, transport, maxsize):
+        super().__init__()
+        self._transport = transport
+        self._maxsize = maxsize
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, verify, cert, proxy):
+        if isinstance(cert, list):
+            cert = tuple(cert)
+        key = (verify, cert, proxy)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                if isinstance(verify, str): # requests 传入的 CA 证书文件/目录
+                    verify = (ssl.create_default_context(capath=verify) if os.path.isdir(verify)
+                              else ssl.create_default_context(cafile=verify))
+                client = self._clients[key] = httpx.Client(
+                    http2=True,
+                    follow_redirects=False,
+                    limits=httpx.Limits(max_connections=self._maxsize, max_keepalive_connections=self._maxsize),
+                    verify=verify,
+                    cert=cert,
+                    proxy=proxy,
+                    trust_env=False,
+                )
+        return client
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self._transport._count('new_connections')
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        client = self._client(verify, cert, requests.utils.select_proxy(request.url, proxies or {}))
+        httpx_request = client.build_request(
+            request.method, request.url,
+            headers=dict(request.headers), content=request.body,
+            timeout=timeout, extensions={"trace": self._trace},
+        )
+        try:
+            with self._transport.dns_scope():
+                httpx_response = client.send(httpx_request, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e, request=request)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+        response = requests.Response()
+        response.status_code = httpx_response.status_code
+        response.reason = httpx_response.reason_phrase
+        response.headers = requests.structures.CaseInsensitiveDict(httpx_response.headers)
+        # httpx 已经解压了响应体，长度和编码头不再对应实际数据
+        response.headers.pop('Content-Encoding', None)
+        response.headers.pop('Content-Length', None)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.raw = _HTTPXRaw(httpx_response)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+class Transport:
+    """
+    【v8.6】网络传输层，对外提供一个配置好的 requests.Session (self.session):
+    - 每个主机一个连接池，池大小可按主机配置 (HOST_POOL_SIZES)
+    - 协商 urllib3 能解压的所有压缩格式 (gzip/deflate，装了 brotli 时还有 br)
+    - TCP keep-alive，连接复用
+    - 可选 HTTP/2 多路复用 (需要 httpx[http2])
+    - DNS 结果缓存
+    - 统计请求数、接收字节数 (解压后)、新建连接数和复用次数
+    """
+
+    def __init__(self, headers, pool_size=POOL_SIZE, host_pool_sizes=None, http2=False, dns_ttl=DNS_CACHE_TTL):
+        self.stats = {'requests': 0, 'bytes_received': 0, 'new_connections': 0}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        self.session.hooks['response'].append(self._on_response)
+
+        if http2 and httpx is None:
+            print("    [警告] 未安装 httpx[http2]，继续使用 HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+
+        # 默认适配器: 最多同时保留 32 个主机的连接池，每个池 pool_size 个连接
+        default_adapter = self._make_adapter(pool_size, num_pools=32)
+        self.session.mount("http://", default_adapter)
+        self.session.mount("https://", default_adapter)
+        for host, size in (host_pool_sizes or {}).items():
+            adapter = self._make_adapter(size, num_pools=1)
+            self.session.mount(f"http://{host}/", adapter)
+            self.session.mount(f"https://{host}/", adapter)
+
+        self.dns_cache = None
+        if dns_ttl:
+            self.dns_cache = _DNSCache(dns_ttl)
+            self.dns_cache.install()
+
+    def _make_adapter(self, maxsize, num_pools):
+        if self.http2:
+            return _HTTP2Adapter(self, maxsize)
+        return _PooledAdapter(self, pool_connections=num_pools, pool_maxsize=maxsize)
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def dns_scope(self):
+        """适配器建立连接时使用 DNS 缓存 (没有开启缓存时什么都不做)。"""
+        return self.dns_cache.scope() if self.dns_cache else nullcontext()
+
+    def close(self):
+        """关闭所有连接，并恢复 socket.getaddrinfo。"""
+        self.session.close()
+        if self.dns_cache:
+            self.dns_cache.uninstall()
+
+    def _on_response(self, response, *args, **kwargs):
+        self._count('requests')
+        # 所有读取 (包括 .text/.content) 最终都经过 iter_content，在这里统计字节数
+        iter_content = response.iter_content
+
+        def counting_iter_content(*iter_args, **iter_kwargs):
+            for chunk in iter_content(*iter_args, **iter_kwargs):
+                self._count('bytes_received', len(chunk))
+                yield chunk
+
+        response.iter_content = counting_iter_content
+        return response
+
+    def summary(self):
+        """一行文字的统计信息。"""
+        stats = dict(self.stats)
+        reused = max(0, stats['requests'] - stats['new_connections'])
+        line = (f"请求 {stats['requests']} 次，接收 {stats['bytes_received'] / 1024:.1f} KB，"
+                f"新建连接 {stats['new_connections']} 个，复用连接 {reused} 次")
+        if self.dns_cache:
+            line += f"，DNS 缓存命中 {self.dns_cache.hits} 次"
+        return line
+
+def configure_transport(http2=False):
+    """【v8.6】(重新) 创建全局传输层。"""
+    global TRANSPORT, SESSION
+    if globals().get('TRANSPORT'):
+        TRANSPORT.close()
+    TRANSPORT = Transport(HEADERS, POOL_SIZE, HOST_POOL_SIZES, http2=http2)
+    # 启动一个共享的 Session，提高网络效率
+    SESSION = TRANSPORT.session
+
+configure_transport()
+
 def get_soup(url):
     """
     一个“有礼貌”的请求函数，负责下载网页并返回一个 'Soup' 对象。
     """
     print(f"    [网络] 正在请求: {url}")
     try:
-        time.sleep(1) # 礼貌性等待
+        wait_for_request_slot() # 礼貌性等待 (【v8.0】所有 worker 共享同一个限速)
         response = SESSION.get(url, timeout=10)
         response.raise_for_status() 
         soup = BeautifulSoup(response.text, 'lxml')
@@ -86,6 +416,201 @@ def sanitize_filename(name):
         name = "Untitled"
     return name
 
+class _HashingFile:
+    """
+    AtomicWriter.open() 返回的写入对象，写入的同时累计大小和 sha256。
+    写入的数据先和已有文件逐段比较；只要一直相同就不碰磁盘，
+    直到出现第一个不同的字节 (或长度超出) 才创建临时文件，并把已比较过的相同前缀复制进去。
+    """
+
+    def __init__(self, path, temp_path):
+        self._temp_path = temp_path
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.changed = None  # with 块结束后: 内容是否与已有文件不同
+        self._out = None     # 临时文件，出现差异后才打开
+        try:
+            self._existing = open(path, 'rb')
+        except OSError:
+            self._existing = None
+            self._diverge()
+
+    def _diverge(self):
+        """从这里开始内容与已有文件不同: 打开临时文件并复制相同的前缀。"""
+        self._out = open(self._temp_path, 'wb')
+        if self._existing:
+            self._existing.seek(0)
+            remaining = self.size
+            while remaining:
+                chunk = self._existing.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                self._out.write(chunk)
+                remaining -= len(chunk)
+            self._existing.close()
+            self._existing = None
+
+    def write(self, chunk):
+        if self._out is None and self._existing.read(len(chunk)) != chunk:
+            self._diverge()
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        if self._out is not None:
+            self._out.write(chunk)
+        return len(chunk)
+
+    def finish(self):
+        """写入结束: 已有文件比新内容长也算变化。返回内容是否变化。"""
+        if self._out is None and self._existing.read(1):
+            self._diverge()
+        self.close()
+        self.changed = self._out is not None
+        return self.changed
+
+    def close(self):
+        if self._existing:
+            self._existing.close()
+            self._existing = None
+        if self._out is not None:
+            self._out.close()
+
+class AtomicWriter:
+    """
+    【v8.2】输出层: 内容不变就不写，写就原子地写。
+    - 写之前先和已有文件比较 (先比大小，大小相同再比 sha256)，完全相同则直接跳过，
+      不改 mtime，同步工具/备份也就不会被惊动。
+    - 内容有变化时先写到同目录下的临时文件，commit() 时统一 fsync 后再 os.replace 覆盖，
+      崩溃时要么是旧文件、要么是新文件，不会留下写了一半的文件。
+    - fsync 按批进行: 暂存的文件达到 batch_size 个或显式调用 commit() 时才落盘。
+    """
+
+    def __init__(self, batch_size=64):
+        self.batch_size = batch_size
+        self._staged = {}  # 目标路径 -> 临时文件路径
+        self._lock = threading.Lock()
+        self.written = 0
+        self.skipped = 0
+
+    @staticmethod
+    def _file_digest(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def _same_as_existing(cls, path, size, hexdigest):
+        try:
+            if os.path.getsize(path) != size:
+                return False
+        except OSError:
+            return False
+        return cls._file_digest(path) == hexdigest
+
+    @staticmethod
+    def _temp_path(path):
+        directory, name = os.path.split(path)
+        return os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    def is_staged(self, path):
+        """该路径是否已写好临时文件、正等待 commit()。"""
+        with self._lock:
+            return path in self._staged
+
+    def write_bytes(self, path, data):
+        """写入二进制内容，内容未变化时返回 False。"""
+        if self._same_as_existing(path, len(data), hashlib.sha256(data).hexdigest()):
+            with self._lock:
+                self.skipped += 1
+            return False
+
+        temp_path = self._temp_path(path)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        self._stage(path, temp_path)
+        return True
+
+    def write_text(self, path, text):
+        """写入 UTF-8 文本，内容未变化时返回 False。"""
+        return self.write_bytes(path, text.encode('utf-8'))
+
+    @contextmanager
+    def open(self, path):
+        """
+        以流的方式写入二进制内容 (例如图片下载、文章正文)。
+        边写边和已有文件比较，内容相同时不创建任何临时文件；
+        with 块中途出错时临时文件被删除，目标文件保持原样。
+        """
+        temp_path = self._temp_path(path)
+        hashing_file = _HashingFile(path, temp_path)
+        try:
+            yield hashing_file
+            changed = hashing_file.finish()
+        except BaseException:
+            hashing_file.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        if not changed:
+            with self._lock:
+                self.skipped += 1
+            return
+        self._stage(path, temp_path)
+
+    def _stage(self, path, temp_path):
+        with self._lock:
+            old_temp = self._staged.pop(path, None)
+            self._staged[path] = temp_path
+            full = len(self._staged) >= self.batch_size
+        if old_temp and old_temp != temp_path and os.path.exists(old_temp):
+            os.remove(old_temp)
+        if full:
+            self.commit()
+
+    def commit(self):
+        """把所有暂存的文件 fsync 后原子替换到位，并 fsync 它们所在的目录。"""
+        with self._lock:
+            staged, self._staged = self._staged, {}
+            if not staged:
+                return
+
+            for temp_path in staged.values():
+                with open(temp_path, 'rb') as f:
+                    os.fsync(f.fileno())
+
+            directories = set()
+            for path, temp_path in staged.items():
+                os.replace(temp_path, path)
+                directories.add(os.path.dirname(path))
+            self.written += len(staged)
+
+        # 目录项也要落盘，rename 才算真正持久化 (Windows 不支持打开目录，跳过)
+        if os.name == 'posix':
+            for directory in directories:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+# 【v8.2】全局共享的输出层
+WRITER = AtomicWriter()
+
+def image_local_filename(img_url):
+    """
+    【v8.1】根据图片 URL 计算 (完整 URL, 本地文件名)，不发任何请求。
+    本地文件名 = URL 的 md5 + 扩展名，所以同一张图无论何时下载都落到同一个文件。
+    """
+    full_img_url = urljoin(BASE_URL, img_url)
+    url_without_params = full_img_url.split('?')[0]
+    ext_match = re.search(r'\.(jpg|jpeg|png|gif|webp)', url_without_params, re.IGNORECASE)
+    ext = ext_match.group(0) if ext_match else '.jpg' # 默认 .jpg
+
+    url_hash = hashlib.md5(full_img_url.encode()).hexdigest()
+    return full_img_url, f"{url_hash}{ext}"
+
 def download_image(img_url, save_dir):
     """
     【v3.0】下载图片并返回本地文件名。
@@ -94,16 +619,10 @@ def download_image(img_url, save_dir):
         return None
 
     try:
-        full_img_url = urljoin(BASE_URL, img_url)
-        url_without_params = full_img_url.split('?')[0]
-        ext_match = re.search(r'\.(jpg|jpeg|png|gif|webp)', url_without_params, re.IGNORECASE)
-        ext = ext_match.group(0) if ext_match else '.jpg' # 默认 .jpg
-        
-        url_hash = hashlib.md5(full_img_url.encode()).hexdigest()
-        local_filename = f"{url_hash}{ext}"
+        full_img_url, local_filename = image_local_filename(img_url)
         save_path = os.path.join(save_dir, local_filename)
 
-        if os.path.exists(save_path):
+        if os.path.exists(save_path) or WRITER.is_staged(save_path):
             print(f"      -> [图片] 已存在: {local_filename}")
             return local_filename
 
@@ -111,10 +630,18 @@ def download_image(img_url, save_dir):
         img_response = SESSION.get(full_img_url, stream=True, timeout=10)
         img_response.raise_for_status()
 
-        with open(save_path, 'wb') as f:
+        # 【v8.2】经由临时文件写入，数据流中断时不会留下半张图片
+        expected_size = img_response.headers.get('Content-Length')
+        if img_response.headers.get('Content-Encoding'):
+            expected_size = None # 压缩传输时 Content-Length 是压缩后的大小，无法比较
+        with WRITER.open(save_path) as f:
             for chunk in img_response.iter_content(1024):
                 f.write(chunk)
-        
+            if expected_size is not None and f.size != int(expected_size):
+                raise IOError(f"图片不完整: 收到 {f.size} / {expected_size} 字节")
+
+        # 【v8.3】记录大小和摘要，供 audit 子命令校验
+        record_image_digest(save_path, full_img_url, f.size, f.digest.hexdigest())
         return local_filename
         
     except requests.exceptions.RequestException as e:
@@ -126,124 +653,336 @@ def download_image(img_url, save_dir):
 
 # --- 3. 核心爬虫模块 (Core Scraper Modules) ---
 
-def scrape_article_page(article_url, image_dir):
+# 【v8.5】正文中需要转换成 Markdown 的块级元素
+ARTICLE_BLOCK_TAGS = ['h2', 'p', 'ul', 'ol', 'blockquote']
+
+class ArticleNotFound(Exception):
+    """【v8.5】文章页中找不到主标题。"""
+
+def render_markdown_element(element, image_dir, image_fetcher=download_image):
     """
-    【模块一：爬取文章详情页 (v5.0 最终版 - 稳定)】
+    【v8.5】把正文中的一个块级元素转换成 Markdown 片段列表 (原 v5.0 核心循环的循环体)。
+    遇到 "想法" 标题 (正文结束) 时返回 None。
     """
-    soup = get_soup(article_url)
-    if not soup:
-        return None, None
-
-    # 1. 定位主标题 (v2.0 逻辑)
-    title_tag = soup.find('h2', class_='tw-text-22')
-    if not title_tag:
-        title_tag = soup.find('h2')
-        if not title_tag:
-            print(f"      -> [失败] 在 {article_url} 找不到主标题 <h2>")
-            return None, None
+    tag_name = element.name
+    markdown_parts = []
 
-    title = title_tag.get_text(strip=True)
-    
-    # 2. 定位正文容器 (v3.0 逻辑)
-    content_body = soup.find('div', id='zx-material-marker-root').find('body')
-    if not content_body:
-        content_body = soup.find('div', id='zx-material-marker-root')
-        if not content_body:
-            print(f"      -> [失败] 在 {article_url} 找不到正文容器 #zx-material-marker-root")
-            return title, f"# {title}\n\n[爬取失败：未找到正文容器]"
-    
-    markdown_parts = [f"# {title}\n"]
+    # 1. 检查停止条件
+    if "想法" in element.get_text(strip=True) and tag_name == 'h2':
+        return None
 
-    # 3. 【v5.0 核心逻辑】
-    elements = content_body.find_all(['h2', 'p', 'ul', 'ol', 'blockquote'])
+    # 2. 【v5.0 修正】 优先检查并抓取 "copyright" 段落
+    if tag_name == 'p' and 'copyright' in element.get('class', []):
+        md_line = ""
+        for content in element.contents:
+            if content.name == 'a':
+                md_line += f"[{content.get_text(strip=True)}]({urljoin(BASE_URL, content.get('href', '#'))})"
+            elif hasattr(content, 'string'):
+                md_line += content.string or ""
+        
+        # 使用 Markdown 引用格式
+        markdown_parts.append(f"\n> {md_line.strip()}\n")
+        return markdown_parts # 本段落处理完毕，跳到下一个元素
 
-    for element in elements:
-        tag_name = element.name
+    # 3. 【v4.0】处理图片 (支持一个 <p> 中有多张图)
+    all_images_in_element = element.find_all('img')
+    if all_images_in_element:
+        for img_tag in all_images_in_element:
+            img_url = img_tag.get('data-src') or img_tag.get('src')
+            if img_url:
+                local_filename = image_fetcher(img_url, image_dir)
+                if local_filename:
+                    # 【v3.1 优化】alt 文本
+                    alt_text = img_tag.get('alt') or local_filename 
+                    # 【v7.0 修正】图片路径现在是固定的 ../../images
+                    # Case 1 (flat=F): ROOT/SECTION/CHAPTER/file.md -> ../../images -> ROOT/images
+                    # Case 2 (flat=T): ROOT/CHAPTER/file.md -> ../../images -> ROOT/images (错误!)
+                    #
+                    # 重新计算路径:
+                    # Case 1 (flat=F): ROOT/SECTION/CHAPTER/file.md -> ../../images
+                    # Case 2 (flat=T): ROOT/CHAPTER/file.md -> ../images
+                    #
+                    # 发现问题，`scrape_article_page` 不知道自己是 flat 还是 non-flat。
+                    #
+                    # 统一解决方案：
+                    # 在 main 函数中，根据 article['section_folder'] 是否为空来决定图片路径！
+                    # 这里暂时不处理，留在 main 函数中
+                    markdown_parts.append(f"![{alt_text}]({local_filename})\n") # 临时占位符
         
-        # 1. 检查停止条件
-        if "想法" in element.get_text(strip=True) and tag_name == 'h2':
-            break 
-
-        # 2. 【v5.0 修正】 优先检查并抓取 "copyright" 段落
-        if tag_name == 'p' and 'copyright' in element.get('class', []):
-            md_line = ""
-            for content in element.contents:
-                if content.name == 'a':
-                    md_line += f"[{content.get_text(strip=True)}]({urljoin(BASE_URL, content.get('href', '#'))})"
-                elif hasattr(content, 'string'):
-                    md_line += content.string or ""
-            
-            # 使用 Markdown 引用格式
-            markdown_parts.append(f"\n> {md_line.strip()}\n")
-            continue # 本段落处理完毕，跳到下一个元素
-
-        # 3. 【v4.0】处理图片 (支持一个 <p> 中有多张图)
-        all_images_in_element = element.find_all('img')
-        if all_images_in_element:
-            for img_tag in all_images_in_element:
-                img_url = img_tag.get('data-src') or img_tag.get('src')
-                if img_url:
-                    local_filename = download_image(img_url, image_dir)
-                    if local_filename:
-                        # 【v3.1 优化】alt 文本
-                        alt_text = img_tag.get('alt') or local_filename 
-                        # 【v7.0 修正】图片路径现在是固定的 ../../images
-                        # Case 1 (flat=F): ROOT/SECTION/CHAPTER/file.md -> ../../images -> ROOT/images
-                        # Case 2 (flat=T): ROOT/CHAPTER/file.md -> ../../images -> ROOT/images (错误!)
-                        #
-                        # 重新计算路径:
-                        # Case 1 (flat=F): ROOT/SECTION/CHAPTER/file.md -> ../../images
-                        # Case 2 (flat=T): ROOT/CHAPTER/file.md -> ../images
-                        #
-                        # 发现问题，`scrape_article_page` 不知道自己是 flat 还是 non-flat。
-                        #
-                        # 统一解决方案：
-                        # 在 main 函数中，根据 article['section_folder'] 是否为空来决定图片路径！
-                        # 这里暂时不处理，留在 main 函数中
-                        markdown_parts.append(f"![{alt_text}]({local_filename})\n") # 临时占位符
+        if not element.get_text(strip=True):
+            return markdown_parts
+
+    # 4. 【v4.0】处理标准文本元素
+    if tag_name == 'h2':
+        markdown_parts.append(f"\n## {element.get_text(strip=True)}\n")
+    elif tag_name == 'ul':
+        items = [li.get_text(strip=True) for li in element.find_all('li')]
+        markdown_parts.append("\n" + "\n".join(f"* {item}" for item in items) + "\n")
+    elif tag_name == 'ol':
+        items = [li.get_text(strip=True) for li in element.find_all('li')]
+        markdown_parts.append("\n" + "\n".join(f"1. {item}" for item in items) + "\n")
+    elif tag_name == 'blockquote':
+        markdown_parts.append(f"> {element.get_text(strip=True)}\n")
+    elif tag_name == 'p':
+        md_line = ""
+        for child in element.contents:
+            if not hasattr(child, 'name'): 
+                md_line += child.string or ""
+                continue
             
-            if not element.get_text(strip=True):
+            if child.name == 'span' and child.find('img'):
                 continue
 
-        # 4. 【v4.0】处理标准文本元素
-        if tag_name == 'h2':
-            markdown_parts.append(f"\n## {element.get_text(strip=True)}\n")
-        elif tag_name == 'ul':
-            items = [li.get_text(strip=True) for li in element.find_all('li')]
-            markdown_parts.append("\n" + "\n".join(f"* {item}" for item in items) + "\n")
-        elif tag_name == 'ol':
-            items = [li.get_text(strip=True) for li in element.find_all('li')]
-            markdown_parts.append("\n" + "\n".join(f"1. {item}" for item in items) + "\n")
-        elif tag_name == 'blockquote':
-            markdown_parts.append(f"> {element.get_text(strip=True)}\n")
-        elif tag_name == 'p':
-            md_line = ""
-            for child in element.contents:
-                if not hasattr(child, 'name'): 
-                    md_line += child.string or ""
+            child_name = child.name
+            if child_name in ['i', 'em']:
+                md_line += f"*{child.get_text(strip=True)}*"
+            elif child_name in ['b', 'strong']:
+                md_line += f"**{child.get_text(strip=True)}**"
+            elif child_name == 'a':
+                md_line += f"[{child.get_text(strip=True)}]({urljoin(BASE_URL, child.get('href', '#'))})"
+            elif child.name is None:
+                md_line += child.string or ""
+            else:
+                md_line += child.get_text() 
+        
+        md_line_stripped = md_line.strip()
+        if md_line_stripped:
+            markdown_parts.append(md_line_stripped + "\n")
+
+    return markdown_parts
+
+def _to_soup_element(elem):
+    """【v8.5】把一个 lxml 元素 (及其子树) 转换成 BeautifulSoup 元素，以复用基于 bs4 的渲染逻辑。"""
+    fragment = BeautifulSoup(etree.tostring(elem, encoding='unicode', with_tail=False), 'lxml')
+    return fragment.find(elem.tag)
+
+def _discard_element(elem):
+    """【v8.5】释放一个已经处理完的 lxml 元素，以及它前面已处理完的兄弟节点。"""
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+def iter_article_markdown(article_url, image_dir, image_fetcher=download_image):
+    """
+    【模块一：爬取文章详情页 (v8.5 流式版)】
+    边下载边解析 (lxml 增量解析器)，第一个产出的是标题，之后依次产出 Markdown 片段。
+    - 响应体按块喂给解析器，不在内存中保留完整的 HTML 文本
+    - #zx-material-marker-root 之外的节点解析完即丢弃，正文中的块级元素渲染完也立即丢弃
+    - 标题与旧版一致: 整页任意位置的 h2.tw-text-22 优先，整页都没有时用整页第一个 h2。
+      标题在正文之前出现时 (常见情况) 正文边解析边产出；否则先缓存渲染好的 Markdown 片段，
+      直到见到 h2.tw-text-22 或整页读完才确定标题
+    - 正文结束 (遇到 "想法" 标题或容器结束) 且标题已确定后立即停止下载
+    - 整页没有正文容器时，产出标题和 "[爬取失败：未找到正文容器]"
+    每个顶层块级元素渲染时，会连同它内部的块级元素按文档顺序一起处理，
+    与旧版 content_body.find_all(ARTICLE_BLOCK_TAGS) 的结果和顺序一致。
+    - 图片不在读取页面的过程中下载 (否则页面连接会在多次图片下载期间一直挂着、
+      不被读取，可能被服务器超时断开，并占用连接池): 解析时只按 URL 算出本地文件名
+      写进 Markdown，页面读完、连接关闭后再依次交给 image_fetcher；
+      下载失败的图片登记到待下载队列，之后由 images 子命令重试。
+    找不到主标题时抛出 ArticleNotFound；网络错误抛出 requests 异常。
+    """
+    print(f"    [网络] 正在请求: {article_url}")
+    wait_for_request_slot() # 礼貌性等待 (【v8.0】所有 worker 共享同一个限速)
+
+    image_urls = []
+    def collect_image(img_url, save_dir):
+        image_urls.append(img_url)
+        return image_local_filename(img_url)[1]
+
+    with SESSION.get(article_url, stream=True, timeout=10) as response:
+        response.raise_for_status()
+        parser = etree.HTMLPullParser(events=('start', 'end'), encoding=response.encoding or 'utf-8')
+
+        title = None          # h2.tw-text-22 (整页任意位置，出现即确定标题)
+        first_h2_title = None # 整页第一个 h2 (整页都没有 h2.tw-text-22 时才用)
+        title_sent = False
+        root = None
+        content_done = False
+        open_blocks = 0   # 正文中尚未结束的块级元素层数
+        pending = []      # 标题确定之前渲染出的片段
+
+        def read_events():
+            nonlocal title, first_h2_title, root, content_done, open_blocks
+            for event, elem in parser.read_events():
+                if not isinstance(elem.tag, str):
                     continue
-                
-                if child.name == 'span' and child.find('img'):
+
+                if event == 'start':
+                    if root is None and elem.tag == 'div' and elem.get('id') == 'zx-material-marker-root':
+                        root = elem
+                    elif root is not None and not content_done and elem.tag in ARTICLE_BLOCK_TAGS:
+                        open_blocks += 1
                     continue
 
-                child_name = child.name
-                if child_name in ['i', 'em']:
-                    md_line += f"*{child.get_text(strip=True)}*"
-                elif child_name in ['b', 'strong']:
-                    md_line += f"**{child.get_text(strip=True)}**"
-                elif child_name == 'a':
-                    md_line += f"[{child.get_text(strip=True)}]({urljoin(BASE_URL, child.get('href', '#'))})"
-                elif child.name is None:
-                    md_line += child.string or ""
-                else:
-                    md_line += child.get_text() 
-            
-            md_line_stripped = md_line.strip()
-            if md_line_stripped:
-                markdown_parts.append(md_line_stripped + "\n")
+                # event == 'end'
+                # 1. 定位主标题 (v2.0 逻辑): 优先整页的 h2.tw-text-22，其次整页第一个 h2
+                if elem.tag == 'h2' and title is None:
+                    text = _to_soup_element(elem).get_text(strip=True)
+                    if 'tw-text-22' in (elem.get('class') or '').split():
+                        title = text
+                    if first_h2_title is None:
+                        first_h2_title = text
+
+                if root is None or content_done:
+                    # 正文之外 (或正文已结束) 的节点解析完即丢弃
+                    if elem is not root:
+                        _discard_element(elem)
+                    continue
+
+                if elem is root:
+                    content_done = True
+                    continue
+
+                if elem.tag in ARTICLE_BLOCK_TAGS:
+                    open_blocks -= 1
+                if open_blocks:
+                    continue # 还在某个块级元素内部，等最外层的块级元素结束时一起处理
+
+                if elem.tag in ARTICLE_BLOCK_TAGS:
+                    element = _to_soup_element(elem)
+                    for block in [element] + element.find_all(ARTICLE_BLOCK_TAGS):
+                        parts = render_markdown_element(block, image_dir, collect_image)
+                        if parts is None:
+                            content_done = True
+                            break
+                        yield from parts
+                _discard_element(elem)
+
+        def header():
+            return [title, f"# {title}\n"]
+
+        for chunk in response.iter_content(64 * 1024):
+            parser.feed(chunk)
+            for part in read_events():
+                if title is None:
+                    pending.append(part)
+                    continue
+                if not title_sent:
+                    title_sent = True
+                    yield from header()
+                    yield from pending
+                    pending = []
+                yield part
+            # 正文结束且标题已确定后立即停止下载；
+            # 标题还没确定时 (还没见到 h2.tw-text-22) 继续读完整页，只找标题
+            if content_done and title is not None:
+                break
+        else:
+            parser.close()
+            pending.extend(read_events())
+
+    if title is None:
+        if first_h2_title is None:
+            raise ArticleNotFound(f"在 {article_url} 找不到主标题 <h2>")
+        title = first_h2_title
+
+    # 页面连接已经关闭，再处理图片
+    for img_url in image_urls:
+        if not image_fetcher(img_url, image_dir):
+            defer_image(img_url, image_dir)
+
+    if root is None:
+        # 2. 定位正文容器 (v3.0 逻辑): 整页都没有正文容器
+        print(f"      -> [失败] 在 {article_url} 找不到正文容器 #zx-material-marker-root")
+        yield title
+        yield f"# {title}\n\n[爬取失败：未找到正文容器]"
+        return
+
+    if not title_sent:
+        yield from header()
+    yield from pending
+
+def scrape_article_page(article_url, image_dir, image_fetcher=download_image):
+    """
+    【v8.5 兼容接口】在 iter_article_markdown() 之上保留旧的 (标题, Markdown 全文) 返回形式。
+    爬虫本身已不再调用它 (process_article 直接使用 iter_article_markdown 边生成边写文件)，
+    只留给需要一次拿到全文的调用方 (例如测试)。
+    图片处理 (image_fetcher / 延迟图片模式) 的行为与 iter_article_markdown() 相同。
+    """
+    try:
+        parts = iter_article_markdown(article_url, image_dir, image_fetcher)
+        title = next(parts, None)
+        if title is None:
+            return None, None
+        return title, "\n".join(parts)
+    except ArticleNotFound as e:
+        print(f"      -> [失败] {e}")
+        return None, None
+    except requests.exceptions.RequestException as e:
+        print(f"    [错误] 请求失败: {e}")
+        return None, None
+
+
+class PlanEntry:
+    """
+    【v8.8】抓取计划中的一篇文章 (取代原来有 5 个字符串键的 dict)。
+    - __slots__: 没有每个实例一份的 __dict__，对象本身 72 字节 (5 个键的 dict 为 184 字节)
+    - 板块/章节名经过 sys.intern: 从清单读回时 json.loads 会为每一行新建字符串，
+      intern 之后同一章节的所有文章共享同一个字符串对象
+    - rel_path 不保存，用到时再拼 (它只是板块/章节/文件名的重复)
+    - 在清单中序列化为紧凑的 JSON 数组 [板块, 章节, 文件名, 标题, URL]
+    """
+
+    __slots__ = ('section_folder', 'chapter_folder', 'filename', 'original_title', 'url')
 
-    # 5. 返回重建好的 Markdown 全文
-    return title, "\n".join(markdown_parts)
+    def __init__(self, section_folder, chapter_folder, filename, original_title, url):
+        self.section_folder = sys.intern(section_folder)
+        self.chapter_folder = sys.intern(chapter_folder)
+        self.filename = filename
+        self.original_title = original_title
+        self.url = url
+
+    def __repr__(self):
+        return f"PlanEntry({self.rel_path!r})"
+
+    @property
+    def rel_path(self):
+        """相对合集根目录的路径，同时也是清单中的任务键和 README 中的链接。"""
+        return "/".join(p for p in (self.section_folder, self.chapter_folder, self.filename) if p)
+
+    @property
+    def img_path_prefix(self):
+        """
+        【v7.0 路径修正】
+        确定图片相对路径 (../../images 还是 ../images)
+        """
+        if self.section_folder: # "E大合集" 模式 (flat=False)
+            # 路径: ROOT/SECTION/CHAPTER/file.md
+            # 相对 images: ../../images/
+            return "../../images/"
+        # "平铺" 模式 (flat=True)
+        # 路径: ROOT/CHAPTER/file.md
+        # 相对 images: ../images/
+        return "../images/"
+
+    def local_path(self, root_dir):
+        """文章 .md 文件在合集根目录下的完整路径。"""
+        return os.path.join(root_dir, self.section_folder, self.chapter_folder, self.filename)
+
+    def to_row(self):
+        return (self.section_folder, self.chapter_folder, self.filename, self.original_title, self.url)
+
+    def to_dict(self):
+        return {
+            "section_folder": self.section_folder,
+            "chapter_folder": self.chapter_folder,
+            "filename": self.filename,
+            "original_title": self.original_title,
+            "url": self.url
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_row(), ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, payload):
+        data = json.loads(payload)
+        if isinstance(data, dict): # v8.0 ~ v8.7 的清单中保存的是 dict
+            return cls(data['section_folder'], data['chapter_folder'], data['filename'],
+                       data['original_title'], data['url'])
+        return cls(*data)
 
 
 def scrape_index_page(section_folder_name, node_id, is_flat_structure=False):
@@ -287,13 +1026,13 @@ def scrape_index_page(section_folder_name, node_id, is_flat_structure=False):
             file_title = f"{number}-{title_text}" if number else title_text
             full_url = urljoin(BASE_URL, url)
                 
-            article_info = {
-                "section_folder": folder_name_to_use, # <-- 【v7.0 升级】
-                "chapter_folder": chapter_name,     
-                "filename": sanitize_filename(file_title) + ".md",
-                "original_title": title_text,
-                "url": full_url
-            }
+            article_info = PlanEntry(
+                folder_name_to_use, # <-- 【v7.0 升级】
+                chapter_name,
+                sanitize_filename(file_title) + ".md",
+                title_text,
+                full_url
+            )
             articles_list.append(article_info)
 
     return articles_list
@@ -345,151 +1084,1079 @@ def scrape_lessons_index_page(section_folder_name, node_url, is_flat_structure=F
             file_title = f"{number}-{title_text}" if number else title_text
             full_url = urljoin(BASE_URL, url)
                 
-            article_info = {
-                "section_folder": folder_name_to_use, # <-- 【v7.0 升级】
-                "chapter_folder": chapter_name,     
-                "filename": sanitize_filename(file_title) + ".md",
-                "original_title": title_text,
-                "url": full_url
-            }
+            article_info = PlanEntry(
+                folder_name_to_use, # <-- 【v7.0 升级】
+                chapter_name,
+                sanitize_filename(file_title) + ".md",
+                title_text,
+                full_url
+            )
             articles_list.append(article_info)
 
     return articles_list
 
 
-# --- 4. 主程序 (Main Execution) ---
+# --- 4. 抓取清单与工作队列 (Crawl Manifest & Work Queue) ---
+
+# 【v8.0】每个线程各自持有一个 SQLite 连接 (sqlite3 连接不能跨线程共享)
+_MANIFEST_LOCAL = threading.local()
 
-def main():
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id              INTEGER PRIMARY KEY,
+    collection_name TEXT    NOT NULL,
+    target_name     TEXT    NOT NULL,
+    rel_path        TEXT    NOT NULL,
+    seq             INTEGER NOT NULL,
+    payload         TEXT    NOT NULL,
+    status          TEXT    NOT NULL DEFAULT 'pending',
+    lease_owner     TEXT,
+    lease_expires   REAL,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    last_error      TEXT,
+    priority        INTEGER NOT NULL DEFAULT 0,
+    last_fetched    REAL,
+    UNIQUE (collection_name, rel_path)
+);
+CREATE TABLE IF NOT EXISTS index_pages (
+    collection_name TEXT NOT NULL,
+    target_name     TEXT NOT NULL,
+    digest          TEXT NOT NULL,
+    changed_at      REAL NOT NULL,
+    PRIMARY KEY (collection_name, target_name)
+);
+CREATE TABLE IF NOT EXISTS pending_images (
+    save_path     TEXT    PRIMARY KEY,
+    url           TEXT    NOT NULL,
+    status        TEXT    NOT NULL DEFAULT 'pending',
+    lease_owner   TEXT,
+    lease_expires REAL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    next_attempt  REAL    NOT NULL DEFAULT 0,
+    last_error    TEXT
+);
+CREATE INDEX IF NOT EXISTS pending_images_claim ON pending_images (status, next_attempt);
+CREATE TABLE IF NOT EXISTS image_digests (
+    save_path TEXT    PRIMARY KEY,
+    url       TEXT    NOT NULL,
+    size      INTEGER NOT NULL,
+    sha256    TEXT    NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_limit (
+    name      TEXT PRIMARY KEY,
+    next_slot REAL NOT NULL
+);
+"""
+
+def _migrate_manifest(conn):
+    """【v8.7】为旧版本创建的清单补上新增的列和索引。"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if 'priority' not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+    if 'last_fetched' not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN last_fetched REAL")
+        # 旧版本中已完成的任务当作 "已抓取过"，按清单时间排在从未抓取的任务之后
+        conn.execute("UPDATE jobs SET priority = 2, last_fetched = 0 WHERE status = 'done'")
+    conn.execute("DROP INDEX IF EXISTS jobs_claim")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_schedule ON jobs (status, priority, last_fetched, collection_name, seq)"
+    )
+
+def get_manifest():
     """
-    【总指挥 (v7.0)】
-    - 遍历 COLLECTIONS 列表，为每个“合集”创建独立的根目录、图片目录、README 和 JSON。
+    【v8.0】返回当前线程的清单库连接，第一次使用时建表。
+    - 使用默认的 rollback journal 而不是 WAL: WAL 依赖共享内存，在网络文件系统上不可靠。
+    - isolation_level=None: 事务全部由 manifest_transaction() 显式控制。
     """
-    print(f"--- 开始爬取 有知有行 全合集 (v7.0) ---")
-    
+    conn = getattr(_MANIFEST_LOCAL, 'conn', None)
+    if conn is None or _MANIFEST_LOCAL.path != MANIFEST_PATH:
+        conn = sqlite3.connect(MANIFEST_PATH, timeout=60, isolation_level=None)
+        conn.executescript(MANIFEST_SCHEMA)
+        _migrate_manifest(conn)
+        _MANIFEST_LOCAL.conn = conn
+        _MANIFEST_LOCAL.path = MANIFEST_PATH
+    return conn
+
+@contextmanager
+def manifest_transaction():
+    """
+    【v8.0】BEGIN IMMEDIATE 事务: 一开始就拿到写锁，多个进程同时 "读-改-写" 也不会冲突。
+    """
+    conn = get_manifest()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+def wait_for_request_slot(name='global', interval=None):
+    """
+    【v8.0】全局限速。
+    所有 worker 在清单库中共享一个 "下一个可用时间槽"，每次请求前领取一个槽位再睡到那一刻，
+    这样无论开多少个 worker，合计每 REQUEST_INTERVAL 秒最多只发出一个请求。
+    (多台机器时依赖各机器时钟大致同步)
+    - 【v8.1】name 区分不同的限速通道，例如图片阶段使用独立的 'images' 通道。
+    """
+    if interval is None:
+        interval = REQUEST_INTERVAL
+    with manifest_transaction() as conn:
+        row = conn.execute("SELECT next_slot FROM rate_limit WHERE name = ?", (name,)).fetchone()
+        slot = max(time.time(), row[0] if row else 0)
+        conn.execute(
+            "INSERT OR REPLACE INTO rate_limit (name, next_slot) VALUES (?, ?)",
+            (name, slot + interval)
+        )
+    delay = slot - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+def record_index_page(collection_name, target_name, articles):
+    """
+    【v8.7】记录一个板块索引页的内容摘要，返回该索引页最近一次发生变化的时间。
+    第一次记录时没有可比较的旧内容，不算作变化 (返回 0)。
+    """
+    digest = hashlib.sha256(
+        json.dumps([article.to_dict() for article in articles], ensure_ascii=False, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+    now = time.time()
+    with manifest_transaction() as conn:
+        row = conn.execute(
+            "SELECT digest, changed_at FROM index_pages WHERE collection_name = ? AND target_name = ?",
+            (collection_name, target_name)
+        ).fetchone()
+        if row and row[0] == digest:
+            return row[1]
+        changed_at = now if row else 0
+        conn.execute(
+            "INSERT OR REPLACE INTO index_pages (collection_name, target_name, digest, changed_at) VALUES (?, ?, ?, ?)",
+            (collection_name, target_name, digest, changed_at)
+        )
+    if row:
+        print(f"    [信息] 索引页有更新: {target_name}")
+    return changed_at
+
+def enqueue_articles(collection_name, target_name, articles, index_changed_at=0):
+    """
+    【v8.0】把一个板块的文章写入队列 (按 rel_path 去重)。
+    - 已存在的任务重新置为 pending (每次计划都会重新检查一遍)，正被租用的任务不动。
+    - 该板块中已经不在索引页上的旧任务被清理掉。
+    - 【v8.7】同时计算调度优先级 (数字越小越先处理):
+      0 = 从未抓取过；1 = 上次抓取之后索引页有变化；2 = 其余，按上次抓取时间从旧到新
+    """
+    with manifest_transaction() as conn:
+        row = conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM jobs WHERE collection_name = ?", (collection_name,)
+        ).fetchone()
+        # seq 用于保持索引页上的原始顺序 (README 依赖它)
+        seq = row[0]
+        rel_paths = []
+        for article in articles:
+            seq += 1
+            rel_path = article.rel_path
+            rel_paths.append(rel_path)
+            conn.execute(
+                """
+                INSERT INTO jobs (collection_name, target_name, rel_path, seq, payload)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (collection_name, rel_path) DO UPDATE SET
+                    target_name = excluded.target_name,
+                    seq         = excluded.seq,
+                    payload     = excluded.payload,
+                    status      = CASE WHEN jobs.status = 'leased' THEN jobs.status ELSE 'pending' END,
+                    attempts    = CASE WHEN jobs.status = 'leased' THEN jobs.attempts ELSE 0 END,
+                    last_error  = NULL,
+                    priority    = CASE WHEN jobs.last_fetched IS NULL THEN 0
+                                       WHEN ? > jobs.last_fetched THEN 1
+                                       ELSE 2 END
+                """,
+                (collection_name, target_name, rel_path, seq, article.to_json(), index_changed_at)
+            )
+        conn.execute(
+            f"DELETE FROM jobs WHERE collection_name = ? AND target_name = ? AND status != 'leased' "
+            f"AND rel_path NOT IN ({','.join('?' * len(rel_paths))})",
+            (collection_name, target_name, *rel_paths)
+        )
+
+def _only_filter(column, values):
+    """【v8.3】values 不为 None 时，生成把查询限制在这些值之内的 SQL 条件和参数。"""
+    if values is None:
+        return "", ()
+    values = tuple(values)
+    return f" AND {column} IN ({','.join('?' * len(values))})", values
+
+def claim_job(worker_id, job_ids=None):
+    """
+    【v8.0】领取一个任务 (pending，或租约已过期的 leased)，返回 (job_id, collection_name, article)。
+    没有可领取的任务时返回 None。
+    - 【v8.3】job_ids 不为 None 时只领取其中的任务 (audit --repair 只处理它重新排队的任务)
+    - 【v8.7】崩溃 worker 遗留的任务最先接手，其余按 优先级 -> 上次抓取时间 -> 索引顺序 领取
+    - 租约过期且已用完 MAX_ATTEMPTS 次的任务直接标记 failed，不再接手
+      (否则一个每次都让 worker 崩溃的任务会被无限重领，并且总排在最前面)
+    """
+    now = time.time()
+    only, only_params = _only_filter('id', job_ids)
+    with manifest_transaction() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', lease_owner = NULL, lease_expires = NULL, "
+            "last_error = '租约过期 (worker 可能已崩溃)' "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, MAX_ATTEMPTS)
+        )
+        row = conn.execute(
+            "SELECT id, collection_name, payload FROM jobs WHERE status = 'leased' AND lease_expires < ?"
+            f"{only} LIMIT 1",
+            (now, *only_params)
+        ).fetchone()
+        if not row:
+            row = conn.execute(
+                f"""
+                SELECT id, collection_name, payload FROM jobs
+                WHERE status = 'pending'{only}
+                ORDER BY priority, last_fetched, collection_name, seq
+                LIMIT 1
+                """,
+                only_params
+            ).fetchone()
+        if not row:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+            "WHERE id = ?",
+            (worker_id, now + LEASE_SECONDS, row[0])
+        )
+    return row[0], row[1], PlanEntry.from_json(row[2])
+
+def ack_job(job_id, worker_id, ok, error=None):
+    """
+    【v8.0】确认任务结果。
+    - 成功: done
+    - 失败: 未超过 MAX_ATTEMPTS 则放回 pending，否则标记 failed
+    只有当前租约持有者的确认才生效 (租约过期后被别人接手的任务不会被覆盖)。
+    """
+    with manifest_transaction() as conn:
+        if ok:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', lease_owner = NULL, lease_expires = NULL, last_error = NULL, "
+                "priority = 2, last_fetched = ? WHERE id = ? AND lease_owner = ?",
+                (time.time(), job_id, worker_id)
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_owner = NULL, lease_expires = NULL, last_error = ? "
+                "WHERE id = ? AND lease_owner = ?",
+                (MAX_ATTEMPTS, error, job_id, worker_id)
+            )
+
+def defer_image(img_url, save_dir):
+    """
+    【v8.1】延迟图片模式下替代 download_image: 只把图片登记到 pending_images 队列，
+    立即返回最终的本地文件名，让 Markdown 可以先写好。
+    本地已存在的图片不再登记。
+    """
+    if not img_url:
+        return None
+
+    full_img_url, local_filename = image_local_filename(img_url)
+    save_path = os.path.join(save_dir, local_filename)
+
+    if os.path.exists(save_path):
+        return local_filename
+
+    with manifest_transaction() as conn:
+        # 之前下载过 (done) 但文件已经不在了，重新排队
+        conn.execute(
+            """
+            INSERT INTO pending_images (save_path, url) VALUES (?, ?)
+            ON CONFLICT (save_path) DO UPDATE SET
+                status = CASE WHEN pending_images.status = 'done' THEN 'pending' ELSE pending_images.status END
+            """,
+            (save_path, full_img_url)
+        )
+    print(f"      -> [图片] 已加入待下载队列: {local_filename}")
+    return local_filename
+
+def claim_pending_image(worker_id, run_started, save_paths=None):
+    """
+    【v8.1】领取一张待下载图片，返回 (save_path, url)，没有可领取的返回 None。
+    - 【v8.3】save_paths 不为 None 时只领取其中的图片
+    只领取 next_attempt <= run_started 的图片: 本轮失败的图片会被推迟到下一轮再重试。
+    租约过期且已用完 MAX_ATTEMPTS 次的图片直接标记 failed (与 claim_job 相同)。
+    """
+    now = time.time()
+    only, only_params = _only_filter('save_path', save_paths)
+    with manifest_transaction() as conn:
+        conn.execute(
+            "UPDATE pending_images SET status = 'failed', lease_owner = NULL, lease_expires = NULL, "
+            "last_error = '租约过期 (worker 可能已崩溃)' "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, MAX_ATTEMPTS)
+        )
+        row = conn.execute(
+            f"""
+            SELECT save_path, url FROM pending_images
+            WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+              AND next_attempt <= ?{only}
+            ORDER BY next_attempt
+            LIMIT 1
+            """,
+            (now, run_started, *only_params)
+        ).fetchone()
+        if not row:
+            return None
+        conn.execute(
+            "UPDATE pending_images SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+            "attempts = attempts + 1 WHERE save_path = ?",
+            (worker_id, now + LEASE_SECONDS, row[0])
+        )
+    return row
+
+def ack_pending_image(save_path, worker_id, ok, error=None):
+    """
+    【v8.1】确认图片下载结果。
+    失败的图片未超过 MAX_ATTEMPTS 次则放回 pending，并推迟到下一轮运行再重试；否则标记 failed，
+    不再每轮重复请求 (audit --repair 可以重新排队)。
+    """
+    with manifest_transaction() as conn:
+        if ok:
+            conn.execute(
+                "UPDATE pending_images SET status = 'done', lease_owner = NULL, lease_expires = NULL, "
+                "last_error = NULL WHERE save_path = ? AND lease_owner = ?",
+                (save_path, worker_id)
+            )
+        else:
+            conn.execute(
+                "UPDATE pending_images SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_owner = NULL, lease_expires = NULL, next_attempt = ?, last_error = ? "
+                "WHERE save_path = ? AND lease_owner = ?",
+                (MAX_ATTEMPTS, time.time(), error, save_path, worker_id)
+            )
+
+def record_image_digest(save_path, url, size, sha256):
+    """【v8.3】记录一张已下载图片的来源、大小和 sha256。"""
+    with manifest_transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO image_digests (save_path, url, size, sha256) VALUES (?, ?, ?, ?)",
+            (save_path, url, size, sha256)
+        )
+
+def count_jobs_by_status():
+    """【v8.7】各状态的任务数，例如 {'done': 120, 'pending': 30}。"""
+    return dict(get_manifest().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+def count_leased_jobs(job_ids=None):
+    """【v8.0】当前仍被 (未过期租约) 占用的任务数 (【v8.3】job_ids 不为 None 时只统计其中的任务)。"""
+    only, only_params = _only_filter('id', job_ids)
+    row = get_manifest().execute(
+        f"SELECT COUNT(*) FROM jobs WHERE status = 'leased' AND lease_expires >= ?{only}",
+        (time.time(), *only_params)
+    ).fetchone()
+    return row[0]
+
+
+# --- 5. 主程序 (Main Execution) ---
+
+def budget_exhausted():
+    """
+    【v8.7】本次运行的请求数或时间预算是否已经用完。
+    请求数来自传输层的计数 (规划、正文、图片请求都算在内)。
+    """
+    if MAX_REQUESTS is not None and TRANSPORT.stats['requests'] >= MAX_REQUESTS:
+        return True
+    if MAX_SECONDS is not None and time.time() - RUN_STARTED >= MAX_SECONDS:
+        return True
+    return False
+
+def collection_paths(collection_name):
+    """【v8.0】返回一个合集的 (根目录, 图片目录)。"""
+    root_dir = os.path.join(SCRIPT_DIR, collection_name)
+    return root_dir, os.path.join(root_dir, "images")
+
+def process_article(article, root_dir, image_dir, image_fetcher=download_image):
+    """
+    【v8.0】爬取单篇文章并写入 .md 文件 (原 main() 中第 5 步的逻辑)。
+    成功返回 True。
+    """
+    # 【v7.0 核心路径逻辑】
+    # `article.section_folder` 要么是 "01-投资理念", 要么是 "" (空字符串)
+    file_path = article.local_path(root_dir)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    print(f"    [文章] 正在处理: {article.original_title}")
+
+    img_path_prefix = article.img_path_prefix
+
+    # 【调用模块一】【v8.5】边爬取正文边写入 .md 文件，不在内存中拼接全文
+    # (【v8.2】内容没变就不写；中途失败时已有文件保持原样)
+    try:
+        parts = iter_article_markdown(article.url, image_dir, image_fetcher)
+        next(parts) # 标题
+        with WRITER.open(file_path) as f:
+            for index, part in enumerate(parts):
+                # 替换图片路径占位符
+                part = MD_IMAGE_PATTERN.sub(
+                    lambda match: f"![{match.group(1)}]({img_path_prefix}{match.group(2)})",
+                    part
+                )
+                f.write((part if index == 0 else "\n" + part).encode('utf-8'))
+    except ArticleNotFound as e:
+        print(f"      -> [失败] {e}")
+        return False
+    except requests.exceptions.RequestException as e:
+        print(f"    [错误] 请求失败: {e}")
+        print(f"      -> [失败] 无法爬取: {article.url}")
+        return False
+
+    if f.changed:
+        print(f"      -> [成功] 已保存到: {file_path}")
+    else:
+        print(f"      -> [跳过] 内容未变化: {file_path}")
+    return True
+
+def plan_crawl():
+    """
+    【v8.0 规划器】
+    只爬取各合集的索引页，把所有文章作为任务写入清单队列，不下载正文。
+    - 【v8.7】预算用完时停止扫描，未扫描的板块保留上一次的计划。
+    """
+    print(f"--- [规划] 开始扫描索引页 (清单: {MANIFEST_PATH}) ---")
+
     # 1. 遍历我们定义的每个“合集”
     for collection in COLLECTIONS:
         collection_name = collection['collection_name']
-        
-        # 2. 为每个合集设置独立的路径
-        ROOT_DIR = os.path.join(SCRIPT_DIR, collection_name)
-        IMAGE_DIR = os.path.join(ROOT_DIR, "images")
-        
-        print(f"\n--- [合集] 正在处理: {collection_name} ---")
-        print(f"    [路径] 合集根目录: {ROOT_DIR}")
-
-        os.makedirs(ROOT_DIR, exist_ok=True)
-        os.makedirs(IMAGE_DIR, exist_ok=True)
-        
-        all_articles_data = [] # 每个合集都有自己的备份
-        readme_content = [f"# {collection_name} 总目录\n"] # 每个合集都有自己的README
+        print(f"\n--- [合集] 正在规划: {collection_name} ---")
 
-        # 3. 遍历该合集下的所有“目标板块”
+        # 2. 遍历该合集下的所有“目标板块”
         for target in collection['targets']:
-            
+
+            if budget_exhausted():
+                print("  [预算] 本次运行的预算已用完，停止扫描索引页")
+                return
+
             target_name = target['name']
             is_flat = target['is_flat']
             print(f"  [板块] 正在处理: {target_name}")
-            
+
             articles_to_scrape = []
-            
-            # 4. 根据类型调用不同的索引爬虫
+
+            # 3. 根据类型调用不同的索引爬虫
             if target['type'] == 'ezone':
                 print("    [模式] Ezone/Skeleton 索引模式")
                 articles_to_scrape = scrape_index_page(target_name, target['id'], is_flat_structure=is_flat)
-            
+
             elif target['type'] == 'lessons':
                 print("    [模式] Lessons 课程模式")
                 articles_to_scrape = scrape_lessons_index_page(target_name, target['url'], is_flat_structure=is_flat)
-            
+
             if not articles_to_scrape:
+                # 索引页抓取失败时保留上一次的计划，不清空队列
                 print(f"    [警告] 在板块 {target_name} 没有找到任何文章。")
                 continue
-                
-            print(f"    [信息] 在 {target_name} 找到 {len(articles_to_scrape)} 篇文章。")
-            
-            current_readme_chapter = ""
 
-            # 5. 遍历这个板块的每篇文章
-            for article in articles_to_scrape:
-                
-                # 【v7.0 核心路径逻辑】
-                # `article['section_folder']` 要么是 "01-投资理念", 要么是 "" (空字符串)
-                section_path = os.path.join(ROOT_DIR, article['section_folder'])
-                chapter_path = os.path.join(section_path, article['chapter_folder'])
-                os.makedirs(chapter_path, exist_ok=True)
-                
-                if article['chapter_folder'] != current_readme_chapter:
-                    # 如果 section_folder 不为空，说明是 "E大合集" 模式, README 加一级
-                    if article['section_folder']:
-                        # 检查是否是新的 section
-                        current_section_readme = f"\n## {article['section_folder']}\n"
-                        if current_section_readme not in readme_content:
-                             readme_content.append(current_section_readme)
-                    
-                    readme_content.append(f"\n### {article['chapter_folder']}\n")
-                    current_readme_chapter = article['chapter_folder']
-
-                file_path = os.path.join(chapter_path, article['filename'])
-                
-                print(f"    [文章] 正在处理: {article['original_title']}")
-                
-                # 5.4 【调用模块一】爬取文章正文
-                title, markdown_content = scrape_article_page(article['url'], IMAGE_DIR)
-                
-                if markdown_content:
-                    
-                    # 【v7.0 路径修正】
-                    # 确定图片相对路径 (../../images 还是 ../images)
-                    if article['section_folder']: # "E大合集" 模式 (flat=False)
-                        # 路径: ROOT/SECTION/CHAPTER/file.md
-                        # 相对 images: ../../images/
-                        img_path_prefix = "../../images/"
-                    else: # "平铺" 模式 (flat=True)
-                        # 路径: ROOT/CHAPTER/file.md
-                        # 相对 images: ../images/
-                        img_path_prefix = "../images/"
-                    
-                    # 替换图片路径占位符
-                    markdown_content = re.sub(
-                        r"!\[(.*?)]\((.*?)\)",
-                        lambda match: f"![{match.group(1)}]({img_path_prefix}{match.group(2)})",
-                        markdown_content
-                    )
-
-                    # 5.5 写入 .md 文件
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        f.write(markdown_content)
-                    
-                    print(f"      -> [成功] 已保存到: {file_path}")
-                    
-                    # 5.6 为 README.md 添加条目
-                    # 构造从 ROOT_DIR 开始的相对路径
-                    relative_path = os.path.relpath(file_path, ROOT_DIR).replace("\\", "/")
-                    
-                    readme_content.append(f"* [{article['original_title']}]({relative_path})")
-                    
-                    # 5.7 为 .json 备份添加数据
-                    article['markdown_content'] = "[...内容已保存到 .md 文件...]"
-                    article['local_path'] = file_path
-                    all_articles_data.append(article)
-                    
-                else:
-                    print(f"      -> [失败] 无法爬取: {article['url']}")
-
-        # 6. 【收尾】为 *当前合集* 生成 .json 备份
-        json_path = os.path.join(ROOT_DIR, f"{collection_name}_articles.json")
-        print(f"  [收尾] 正在为 {collection_name} 生成 JSON 备份: {json_path}")
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(all_articles_data, f, indent=2, ensure_ascii=False)
+            print(f"    [信息] 在 {target_name} 找到 {len(articles_to_scrape)} 篇文章，已加入队列。")
+            index_changed_at = record_index_page(collection_name, target_name, articles_to_scrape)
+            enqueue_articles(collection_name, target_name, articles_to_scrape, index_changed_at)
 
-        # 7. 【收尾】为 *当前合集* 生成 README.md 总目录
-        readme_path = os.path.join(ROOT_DIR, 'README.md')
-        print(f"  [收尾] 正在为 {collection_name} 生成 README.md 总目录: {readme_path}")
-        with open(readme_path, 'w', encoding='utf-8') as f:
-            f.write("\n".join(readme_content))
+def run_worker(worker_id=None, defer_images=False, job_ids=None):
+    """
+    【v8.0 worker】
+    循环领取任务 -> 爬取 -> 写文件 -> 确认，直到队列中没有任何待处理或被租用的任务。
+    可以在多个进程/多台机器上同时运行。
+    - 【v8.1】defer_images=True 时只登记图片，不下载，交给 fetch_pending_images() 处理。
+    - 【v8.7】预算用完后不再领取新任务，手上的任务确认后退出。
+    - 【v8.3】job_ids 不为 None 时只处理其中的任务 (audit --repair)。
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    image_fetcher = defer_image if defer_images else download_image
+    print(f"--- [Worker {worker_id}] 开始处理队列 ---")
+
+    while True:
+        if budget_exhausted():
+            remaining = count_jobs_by_status().get('pending', 0)
+            print(f"--- [Worker {worker_id}] 预算已用完，剩余 {remaining} 个任务留待下次运行 ---")
+            break
+
+        job = claim_job(worker_id, job_ids)
+        if job is None:
+            # 其他 worker 手上还有任务: 等一会儿，如果它们崩溃了，过期的租约会被我们接手
+            if count_leased_jobs(job_ids):
+                time.sleep(5)
+                continue
+            print(f"--- [Worker {worker_id}] 队列已清空 ---")
+            break
+
+        job_id, collection_name, article = job
+        root_dir, image_dir = collection_paths(collection_name)
+        os.makedirs(image_dir, exist_ok=True)
+
+        try:
+            ok = process_article(article, root_dir, image_dir, image_fetcher)
+            # 【v8.2】先让本篇文章的 .md 和图片落盘，再确认任务
+            WRITER.commit()
+            ack_job(job_id, worker_id, ok, None if ok else "无法爬取")
+        except Exception as e:
+            print(f"      -> [错误] 任务处理失败: {e}")
+            ack_job(job_id, worker_id, False, repr(e))
+
+    print(f"  [网络] {TRANSPORT.summary()}")
+
+def fetch_pending_images(worker_id=None, interval=None, save_paths=None):
+    """
+    【v8.1 图片阶段】
+    以独立的限速 (IMAGE_REQUEST_INTERVAL) 下载 pending_images 队列中的图片。
+    本轮失败的图片留在队列里，下一次运行时再重试 (最多 MAX_ATTEMPTS 次)。可以多开。
+    - 【v8.3】save_paths 不为 None 时只下载其中的图片 (audit --repair)。
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    if interval is None:
+        interval = IMAGE_REQUEST_INTERVAL
+    run_started = time.time()
+    done, failed = 0, 0
+    print(f"--- [图片 {worker_id}] 开始下载待下载图片 ---")
+
+    while True:
+        if budget_exhausted():
+            print(f"--- [图片 {worker_id}] 预算已用完，剩余图片留待下次运行 ---")
+            break
+
+        item = claim_pending_image(worker_id, run_started, save_paths)
+        if item is None:
+            break
+
+        save_path, url = item
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        wait_for_request_slot('images', interval)
+        local_filename = download_image(url, os.path.dirname(save_path))
+        WRITER.commit()
+
+        if local_filename:
+            done += 1
+            ack_pending_image(save_path, worker_id, True)
+        else:
+            failed += 1
+            ack_pending_image(save_path, worker_id, False, "下载失败")
+
+    print(f"--- [图片 {worker_id}] 本轮完成 {done} 张，失败 {failed} 张 (失败的将在下次运行时重试，最多 {MAX_ATTEMPTS} 次) ---")
+    print(f"  [网络] {TRANSPORT.summary()}")
+
+def main(defer_images=False):
+    """
+    【总指挥 (v8.0)】
+    单机模式: 规划 -> 在本进程中跑一个 worker -> 收尾。
+    多 worker 模式请分别使用 plan / work / finalize 子命令。
+    - 【v8.1】defer_images=True 时先完成全部文字，最后再进入图片阶段。
+    """
+    print(f"--- 开始爬取 有知有行 全合集 (v8.0) ---")
+
+    plan_crawl()
+    run_worker(defer_images=defer_images)
+    build_indexes()
+    if defer_images:
+        fetch_pending_images()
+
+    print(f"  [输出] 写入 {WRITER.written} 个文件，跳过 {WRITER.skipped} 个未变化的文件")
 
     print("\n--- ✅ 所有合集任务已完成 ---")
 
-# --- 5. 运行主程序 ---
+# --- 6. 完整性检查与修复 (Integrity Audit & Repair) ---
+
+# Markdown 中的图片链接 / README 中的文章条目 / AtomicWriter 遗留的临时文件
+MD_IMAGE_PATTERN = re.compile(r"!\[(.*?)]\((.*?)\)")
+# 总目录: "* [标题](路径)"；章节目录 (【v8.4】): "* [标题](文件名) (N 字)"
+README_LINK_PATTERN = re.compile(r"^\* \[.*?]\((.*?)\)(?: \(\d+ 字\))?$", re.MULTILINE)
+TEMP_FILE_PATTERN = re.compile(r"^\..+\.\d+\.\d+\.tmp$")
+# 无法按文件头识别的格式 (SVG/AVIF/BMP 等也会以默认的 .jpg 保存)，只报告，不当作损坏处理
+UNKNOWN_IMAGE_FORMAT = "无法识别的图片格式"
+
+def check_image_file(path, record=None):
+    """
+    【v8.3】检查一张图片是否完整，返回问题描述，没有问题返回 None。
+    - 有下载记录时，比对大小和 sha256
+    - 没有记录时，按文件头识别格式，并检查该格式的结尾标记 (截断的文件通常缺少结尾)
+    """
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return "空文件"
+
+        if record:
+            if size != record['size']:
+                return f"大小不符: {size} / 记录 {record['size']} 字节"
+            if AtomicWriter._file_digest(path) != record['sha256']:
+                return "sha256 与记录不符"
+            return None
+
+        with open(path, 'rb') as f:
+            head = f.read(16)
+            f.seek(max(0, size - 16))
+            tail = f.read(16)
+    except OSError as e:
+        return f"无法读取: {e}"
+
+    if head.startswith(b'\xff\xd8\xff'):
+        if not tail.rstrip(b'\x00').endswith(b'\xff\xd9'):
+            return "JPEG 缺少结尾标记 (可能被截断)"
+    elif head.startswith(b'\x89PNG\r\n\x1a\n'):
+        if not tail.endswith(b'IEND\xaeB`\x82'):
+            return "PNG 缺少 IEND 块 (可能被截断)"
+    elif head[:6] in (b'GIF87a', b'GIF89a'):
+        if not tail.endswith(b'\x3b'):
+            return "GIF 缺少结尾标记 (可能被截断)"
+    elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        if int.from_bytes(head[4:8], 'little') + 8 != size:
+            return "WebP 长度与文件头不符 (可能被截断)"
+    else:
+        return UNKNOWN_IMAGE_FORMAT
+    return None
+
+def scan_markdown_file(md_path):
+    """【v8.3】返回一篇 Markdown 中所有图片链接解析后的绝对路径。"""
+    with open(md_path, encoding='utf-8') as f:
+        text = f.read()
+    md_dir = os.path.dirname(md_path)
+    return [
+        os.path.normpath(os.path.join(md_dir, link))
+        for _, link in MD_IMAGE_PATTERN.findall(text)
+        if not re.match(r"^[a-z]+://", link)
+    ]
+
+def audit_collection(collection_name, workers=AUDIT_WORKERS):
+    """
+    【v8.3】检查一个合集目录，返回问题报告 (dict)。
+    图片校验和 Markdown 解析都放在线程池中并行进行。
+    """
+    root_dir, image_dir = collection_paths(collection_name)
+    report = {
+        "broken_images": {},       # 图片路径 -> 问题
+        "unknown_images": [],      # 无法识别格式的图片 (不修复)
+        "missing_images": {},      # 图片路径 -> 引用它的 .md 列表
+        "image_refs": {},          # 图片路径 -> 引用它的 .md 列表 (修复损坏图片时使用)
+        "missing_articles": [],    # README (总目录或章节目录) 中指向不存在 .md 的链接，相对合集根目录
+        "orphan_images": [],       # 没有任何 .md 引用的图片
+        "orphan_articles": [],     # 不在 README 中的 .md
+        "temp_files": [],          # 中断写入遗留的临时文件
+    }
+    if not os.path.isdir(root_dir):
+        print(f"  [检查] 目录不存在，跳过: {root_dir}")
+        return report
+
+    # 1. 扫描目录树
+    md_files, image_files, readme_files = [], [], []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if TEMP_FILE_PATTERN.match(name):
+                report["temp_files"].append(path)
+            elif dirpath == image_dir:
+                image_files.append(path)
+            elif name == 'README.md':
+                readme_files.append(path)
+            elif name.endswith('.md'):
+                md_files.append(path)
+
+    records = {
+        save_path: {"size": size, "sha256": sha256}
+        for save_path, size, sha256 in get_manifest().execute(
+            "SELECT save_path, size, sha256 FROM image_digests WHERE save_path LIKE ?",
+            (os.path.join(image_dir, "%"),)
+        )
+    }
+
+    # 2. 并行校验图片、解析 Markdown
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        image_results = pool.map(lambda p: (p, check_image_file(p, records.get(p))), image_files)
+        md_results = pool.map(lambda p: (p, scan_markdown_file(p)), md_files)
+
+        for path, problem in image_results:
+            if problem == UNKNOWN_IMAGE_FORMAT:
+                report["unknown_images"].append(path)
+            elif problem:
+                report["broken_images"][path] = problem
+
+        for md_path, image_paths in md_results:
+            for image_path in image_paths:
+                report["image_refs"].setdefault(image_path, []).append(md_path)
+                if not os.path.exists(image_path):
+                    report["missing_images"].setdefault(image_path, []).append(md_path)
+
+    report["orphan_images"] = sorted(set(image_files) - set(report["image_refs"]))
+
+    # 3. README 链接: 总目录和每个章节目录下的 README 都要检查；
+    #    孤立文章以总目录为准
+    readme_path = os.path.join(root_dir, 'README.md')
+    listed_articles = set()
+    missing_articles = set()
+    for path in sorted(readme_files):
+        with open(path, encoding='utf-8') as f:
+            links = README_LINK_PATTERN.findall(f.read())
+        for link in links:
+            md_path = os.path.normpath(os.path.join(os.path.dirname(path), link))
+            if path == readme_path:
+                listed_articles.add(md_path)
+            if not os.path.exists(md_path):
+                missing_articles.add(os.path.relpath(md_path, root_dir).replace("\\", "/"))
+    report["missing_articles"] = sorted(missing_articles)
+    report["orphan_articles"] = sorted(set(md_files) - listed_articles)
+
+    return report
+
+def print_audit_report(collection_name, report):
+    """【v8.3】打印检查结果。"""
+    print(f"\n--- [检查] {collection_name} ---")
+    for path, problem in sorted(report["broken_images"].items()):
+        print(f"    [损坏] {path}: {problem}")
+    for path in sorted(report["unknown_images"]):
+        print(f"    [未识别] {path}: {UNKNOWN_IMAGE_FORMAT} (不做修复)")
+    for path, md_paths in sorted(report["missing_images"].items()):
+        print(f"    [缺失图片] {path} (被 {len(md_paths)} 篇文章引用)")
+    for link in report["missing_articles"]:
+        print(f"    [缺失文章] README 指向不存在的文件: {link}")
+    for path in report["orphan_images"]:
+        print(f"    [孤立图片] {path}")
+    for path in report["orphan_articles"]:
+        print(f"    [孤立文章] 不在 README 中: {path}")
+    for path in report["temp_files"]:
+        print(f"    [临时文件] {path}")
+    print(
+        f"  [汇总] 损坏图片 {len(report['broken_images'])}，未识别图片 {len(report['unknown_images'])}，缺失图片 {len(report['missing_images'])}，"
+        f"缺失文章 {len(report['missing_articles'])}，孤立图片 {len(report['orphan_images'])}，"
+        f"孤立文章 {len(report['orphan_articles'])}，临时文件 {len(report['temp_files'])}"
+    )
+
+def repair_collection(collection_name, report):
+    """
+    【v8.3】只重新获取有问题的部分:
+    - 损坏/缺失的图片: 有下载记录的直接放回 pending_images 队列；
+      没有记录的，把引用它的文章任务放回队列重新爬取
+      (两者都没有、无法重新获取的损坏图片保留原样，不删除)
+    - README 中缺失的文章: 把对应的文章任务放回队列
+    - 遗留的临时文件: 删除
+    - 无法识别格式的图片不做处理
+    返回重新排队的 (图片路径列表, 任务 id 列表)，之后只处理这些，不碰队列中其他待处理的内容。
+    """
+    root_dir, _ = collection_paths(collection_name)
+    conn = get_manifest()
+
+    for path in report["temp_files"]:
+        os.remove(path)
+
+    bad_images = {path: report["image_refs"].get(path, []) for path in report["broken_images"]}
+    bad_images.update(report["missing_images"])
+
+    requeue_rel_paths = set(link for link in report["missing_articles"])
+    requeued_images = []
+
+    for image_path, md_paths in bad_images.items():
+        row = conn.execute(
+            "SELECT url FROM image_digests WHERE save_path = ? "
+            "UNION ALL SELECT url FROM pending_images WHERE save_path = ?",
+            (image_path, image_path)
+        ).fetchone()
+        rel_paths = [
+            rel_path for rel_path in (os.path.relpath(p, root_dir).replace("\\", "/") for p in md_paths)
+            if conn.execute(
+                "SELECT 1 FROM jobs WHERE collection_name = ? AND rel_path = ?", (collection_name, rel_path)
+            ).fetchone()
+        ]
+
+        if not row and not rel_paths:
+            print(f"    [跳过] 没有下载记录，也没有可重新爬取的文章引用它: {image_path}")
+            continue
+
+        # 已存在的文件 download_image 会直接跳过，所以要先删掉
+        if os.path.exists(image_path):
+            os.remove(image_path)
+
+        if row:
+            with manifest_transaction() as tx:
+                tx.execute(
+                    """
+                    INSERT INTO pending_images (save_path, url) VALUES (?, ?)
+                    ON CONFLICT (save_path) DO UPDATE SET status = 'pending', attempts = 0, next_attempt = 0
+                    """,
+                    (image_path, row[0])
+                )
+            requeued_images.append(image_path)
+        else:
+            requeue_rel_paths.update(rel_paths)
+
+    requeued_jobs = []
+    with manifest_transaction() as tx:
+        for rel_path in requeue_rel_paths:
+            row = tx.execute(
+                "SELECT id FROM jobs WHERE collection_name = ? AND rel_path = ? AND status != 'leased'",
+                (collection_name, rel_path)
+            ).fetchone()
+            if row:
+                tx.execute("UPDATE jobs SET status = 'pending', attempts = 0, last_error = NULL WHERE id = ?", row)
+                requeued_jobs.append(row[0])
+
+    return requeued_images, requeued_jobs
+
+def audit(collection_names=None, workers=AUDIT_WORKERS, repair=False):
+    """
+    【v8.3 audit 子命令】检查 (并可选修复) 已有的输出目录。
+    """
+    collection_names = collection_names or [c['collection_name'] for c in COLLECTIONS]
+    image_paths, job_ids = [], []
+
+    for collection_name in collection_names:
+        report = audit_collection(collection_name, workers)
+        print_audit_report(collection_name, report)
+        if repair:
+            images, jobs = repair_collection(collection_name, report)
+            print(f"  [修复] 重新下载 {len(images)} 张图片，重新爬取 {len(jobs)} 篇文章")
+            image_paths.extend(images)
+            job_ids.extend(jobs)
+
+    # 只处理本次修复重新排队的内容，队列中其他待处理的任务/图片留给正常的 work / images
+    if job_ids:
+        run_worker(job_ids=job_ids)
+    if image_paths:
+        fetch_pending_images(save_paths=image_paths)
+
+# --- 7. 索引生成 (Index Builder) ---
+
+# 统计字数: 每个汉字算一个字，连续的字母/数字算一个词
+WORD_PATTERN = re.compile(r"[\u4e00-\u9fff]|[A-Za-z0-9]+")
+
+def natural_sort_key(name):
+    """【v8.4】"2-xx" 排在 "10-xx" 前面。"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+def load_planned_articles(collection_name):
+    """
+    【v8.4】从清单中读取一个合集的文章 (按索引页顺序)。
+    清单中没有这个合集时返回空列表。
+    """
+    rows = get_manifest().execute(
+        "SELECT payload FROM jobs WHERE collection_name = ? ORDER BY seq", (collection_name,)
+    ).fetchall()
+    return [PlanEntry.from_json(payload) for (payload,) in rows]
+
+def scan_collection_tree(collection_name):
+    """
+    【v8.4】没有清单时，直接从目录结构还原文章列表:
+    ROOT/SECTION/CHAPTER/file.md 或 ROOT/CHAPTER/file.md，按名称自然排序。
+    """
+    root_dir, image_dir = collection_paths(collection_name)
+    articles = []
+
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        if dirpath == image_dir:
+            dirnames[:] = []
+            continue
+        dirnames.sort(key=natural_sort_key)
+
+        parts = os.path.relpath(dirpath, root_dir).replace("\\", "/").split("/")
+        if len(parts) == 1 and parts[0] != ".":
+            section_folder, chapter_folder = "", parts[0]
+        elif len(parts) == 2:
+            section_folder, chapter_folder = parts
+        else:
+            continue
+
+        for name in sorted(filenames, key=natural_sort_key):
+            if not name.endswith('.md') or name == 'README.md':
+                continue
+            articles.append(PlanEntry(
+                section_folder,
+                chapter_folder,
+                name,
+                # 文件名是 "编号-标题.md"，去掉编号和扩展名作为标题
+                re.sub(r"^\d+-", "", name[:-len('.md')]),
+                ""
+            ))
+    return articles
+
+def merge_index_articles(planned, on_disk):
+    """
+    【v8.4】以磁盘上实际存在的 .md 为准，合并出要写进索引的文章列表:
+    - 清单只提供顺序、标题和 URL: 清单中的文章按索引页顺序排在前面
+    - 清单路径已不存在、但同名文件 (唯一) 出现在别的目录时 (例如修改了配置或目录结构)，
+      视为搬了家: 沿用清单中的标题和 URL，目录以磁盘为准
+    - 清单没有覆盖到的 .md 按目录结构的自然顺序追加在后面
+    """
+    remaining = {article.rel_path: article for article in on_disk}
+    disk_names = Counter(article.filename for article in on_disk)
+    planned_names = Counter(article.filename for article in planned)
+    by_name = {article.filename: article for article in on_disk if disk_names[article.filename] == 1}
+
+    articles = []
+    for article in planned:
+        if remaining.pop(article.rel_path, None):
+            articles.append(article)
+        elif planned_names[article.filename] == 1 and article.filename in by_name:
+            disk_article = by_name[article.filename]
+            if remaining.pop(disk_article.rel_path, None):
+                articles.append(PlanEntry(
+                    disk_article.section_folder, disk_article.chapter_folder, disk_article.filename,
+                    article.original_title, article.url
+                ))
+
+    articles.extend(remaining.values())
+    return articles
+
+def build_collection_readme(collection_name, indexed):
+    """
+    【v8.4】根据 (已按索引顺序排列的) [(文章, 字数, 图片数), ...] 生成 README 文本。
+    """
+    readme_content = [f"# {collection_name} 总目录\n"]
+    seen_sections = set()
+    current_readme_chapter = ""
+    chapter_stats = {}  # (板块, 章节) -> [文章数, 字数, 图片数]，保持首次出现的顺序
+
+    for article, word_count, image_count in indexed:
+        if article.chapter_folder != current_readme_chapter:
+            # 如果 section_folder 不为空，说明是 "E大合集" 模式, README 加一级
+            if article.section_folder and article.section_folder not in seen_sections:
+                seen_sections.add(article.section_folder)
+                readme_content.append(f"\n## {article.section_folder}\n")
+
+            readme_content.append(f"\n### {article.chapter_folder}\n")
+            current_readme_chapter = article.chapter_folder
+
+        readme_content.append(f"* [{article.original_title}]({article.rel_path})")
+
+        stats = chapter_stats.setdefault((article.section_folder, article.chapter_folder), [0, 0, 0])
+        stats[0] += 1
+        stats[1] += word_count
+        stats[2] += image_count
+
+    totals = [sum(stats[i] for stats in chapter_stats.values()) for i in range(3)]
+    readme_content.append("\n## 统计\n")
+    readme_content.append(f"共 {totals[0]} 篇文章，约 {totals[1]} 字，{totals[2]} 张图片。\n")
+    readme_content.append("| 板块 | 章节 | 文章 | 字数 | 图片 |")
+    readme_content.append("| --- | --- | ---: | ---: | ---: |")
+    for (section_folder, chapter_folder), (count, words, images) in chapter_stats.items():
+        readme_content.append(f"| {section_folder or '-'} | {chapter_folder} | {count} | {words} | {images} |")
+
+    return "\n".join(readme_content)
+
+def build_chapter_readme(chapter_folder, indexed):
+    """【v8.4】根据 [(文章, 字数, 图片数), ...] 生成单个章节目录下的 README.md (章节目录)。"""
+    words = sum(word_count for _, word_count, _ in indexed)
+    images = sum(image_count for _, _, image_count in indexed)
+    lines = [f"# {chapter_folder}\n", f"共 {len(indexed)} 篇文章，约 {words} 字，{images} 张图片。\n"]
+    for article, word_count, _ in indexed:
+        lines.append(f"* [{article.original_title}]({article.filename}) ({word_count} 字)")
+    return "\n".join(lines)
+
+def build_indexes(collection_names=None):
+    """
+    【v8.4 收尾 / index 子命令】
+    不联网，根据目录结构 (清单提供顺序和标题) 为每个合集生成:
+    .json 备份、README.md 总目录 (含统计)、每个章节目录下的 README.md。
+    每篇文章只读一次，整体为线性时间。
+    """
+    collection_names = collection_names or [c['collection_name'] for c in COLLECTIONS]
+
+    for collection_name in collection_names:
+        root_dir, _ = collection_paths(collection_name)
+        if not os.path.isdir(root_dir):
+            print(f"  [收尾] 目录不存在，跳过: {root_dir}")
+            continue
+
+        planned = load_planned_articles(collection_name)
+        if not planned:
+            print(f"  [收尾] 清单中没有 {collection_name}，改为扫描目录结构")
+        articles = merge_index_articles(planned, scan_collection_tree(collection_name))
+
+        indexed = []   # [(文章, 字数, 图片数), ...]
+        chapters = {}  # 章节目录 -> 该章节的 indexed 条目
+        for article in articles:
+            with open(article.local_path(root_dir), encoding='utf-8') as f:
+                text = f.read()
+            item = (article, len(WORD_PATTERN.findall(text)), len(MD_IMAGE_PATTERN.findall(text)))
+            indexed.append(item)
+            chapters.setdefault(os.path.dirname(article.local_path(root_dir)), []).append(item)
+
+        # 为 *当前合集* 生成 README.md 总目录
+        readme_path = os.path.join(root_dir, 'README.md')
+        print(f"  [收尾] 正在为 {collection_name} 生成 README.md 总目录: {readme_path}")
+        WRITER.write_text(readme_path, build_collection_readme(collection_name, indexed))
+
+        # 每个章节目录下的 README.md
+        for chapter_path, chapter_items in chapters.items():
+            WRITER.write_text(
+                os.path.join(chapter_path, 'README.md'),
+                build_chapter_readme(chapter_items[0][0].chapter_folder, chapter_items)
+            )
+
+        # 为 *当前合集* 生成 .json 备份
+        all_articles_data = [
+            {
+                **article.to_dict(),
+                "markdown_content": "[...内容已保存到 .md 文件...]",
+                "local_path": article.local_path(root_dir),
+                "word_count": word_count,
+                "image_count": image_count,
+            }
+            for article, word_count, image_count in indexed
+        ]
+        json_path = os.path.join(root_dir, f"{collection_name}_articles.json")
+        print(f"  [收尾] 正在为 {collection_name} 生成 JSON 备份: {json_path}")
+        WRITER.write_text(json_path, json.dumps(all_articles_data, indent=2, ensure_ascii=False))
+
+        print(f"  [统计] {collection_name}: {len(articles)} 篇文章，{len(chapters)} 个章节")
+
+    # 【v8.2】所有合集的索引文件一起落盘
+    WRITER.commit()
+
+# --- 8. 命令行入口 (Command Line) ---
+
+def cli(argv=None):
+    """
+    【v8.0】命令行入口。不带子命令时等同于以前的一键全量爬取。
+    """
+    global MANIFEST_PATH, MAX_REQUESTS, MAX_SECONDS
+
+    parser = argparse.ArgumentParser(description="有知有行 全合集爬虫")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="抓取清单/工作队列 SQLite 文件路径")
+    parser.add_argument("--defer-images", action="store_true",
+                        help="只登记图片不下载，之后用 images 子命令单独下载")
+    parser.add_argument("--http2", action="store_true", help="启用 HTTP/2 (需要 pip install httpx[http2])")
+    parser.add_argument("--max-requests", type=int, help="本次运行最多发出多少个请求")
+    parser.add_argument("--max-seconds", type=float, help="本次运行最多持续多少秒")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("plan", help="只扫描索引页，把文章任务写入队列")
+    work_parser = subparsers.add_parser("work", help="作为 worker 处理队列中的任务 (可多开)")
+    work_parser.add_argument("--worker-id", help="worker 名称，默认 主机名-进程号")
+    index_parser = subparsers.add_parser("index", aliases=["finalize"],
+                                         help="不联网，根据清单或目录结构生成 README、JSON 和章节目录")
+    index_parser.add_argument("collections", nargs="*", help="要生成的合集名，默认全部")
+    images_parser = subparsers.add_parser("images", help="下载待下载队列中的图片 (可多开)")
+    images_parser.add_argument("--worker-id", help="worker 名称，默认 主机名-进程号")
+    images_parser.add_argument("--interval", type=float, default=IMAGE_REQUEST_INTERVAL,
+                               help="图片请求间隔 (秒)，所有 worker 合计")
+    audit_parser = subparsers.add_parser("audit", help="检查已有输出目录的完整性")
+    audit_parser.add_argument("collections", nargs="*", help="要检查的合集名，默认全部")
+    audit_parser.add_argument("--workers", type=int, default=AUDIT_WORKERS, help="检查线程数")
+    audit_parser.add_argument("--repair", action="store_true", help="重新获取损坏或缺失的部分")
+    args = parser.parse_args(argv)
+
+    MANIFEST_PATH = args.manifest
+    MAX_REQUESTS = args.max_requests
+    MAX_SECONDS = args.max_seconds
+    if args.http2:
+        configure_transport(http2=True)
+
+    if args.command == "plan":
+        plan_crawl()
+    elif args.command == "work":
+        run_worker(args.worker_id, args.defer_images)
+    elif args.command in ("index", "finalize"):
+        build_indexes(args.collections)
+    elif args.command == "images":
+        fetch_pending_images(args.worker_id, args.interval)
+    elif args.command == "audit":
+        audit(args.collections, args.workers, args.repair)
+    else:
+        main(args.defer_images)
+
+# --- 9. 运行主程序 ---
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()